@@ -1,32 +1,47 @@
 # NOT USED
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from shapely.geometry import Polygon
-from shapely.ops import unary_union
-import xml.etree.ElementTree as ET
+import shapely
+from shapely.strtree import STRtree
+from lxml import etree
 import re
-import json
+import orjson
 import inquirer
 from tqdm import tqdm
-from matplotlib.colors import to_rgba
 import numpy as np
-from svgpathtools import parse_path
+from svgpathtools import parse_path, CubicBezier, QuadraticBezier, Line
 from shapely.geometry import Polygon, Point
 from shapely.affinity import scale
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; NumPy kernels below are used instead
+    njit = None
+
 
 SEGMENTS_DIR = Path("segmented_svgs")
 SEGMENTS_PLUS_DIR = Path("segmented_svgs_plus")
 RESPONSES_DIR = Path("gemini_responses")
 OUTPUT_ROOT = Path("hierarchy_output")
 OUTPUT_ROOT.mkdir(exist_ok=True)
+SVG_NS = "http://www.w3.org/2000/svg"
+# Tolerance (in SVG units) used to simplify polygons for containment queries
+SIMPLIFY_TOLERANCE = 0.5
+
+# Filename/CSS patterns compiled once at import; these run per segment
+_RE_ELEMENT = re.compile(r'_element_(\d+)')
+_RE_LAYER = re.compile(r'Layer[_ ]?(\d+)')
+_CSS_RULE_RE = re.compile(r'([^{}]+)\{([^}]*)\}')
 
 def extract_index_from_filename(name: str) -> int:
     # Try "_element_XX" pattern
-    match = re.search(r'_element_(\d+)', name)
+    match = _RE_ELEMENT.search(name)
     if match:
         return int(match.group(1))
     # Try "Layer XX" pattern
-    match = re.search(r'Layer[_ ]?(\d+)', name)
+    match = _RE_LAYER.search(name)
     if match:
         return int(match.group(1))
     return -1
@@ -37,41 +52,313 @@ def sort_key(seg):
         return (0, extract_index_from_filename(name))
     return (1, extract_index_from_filename(name))
 
+# Sample positions reused for arc fallback evaluation (computed once at import)
+_T_SAMPLE = np.linspace(0.0, 1.0, 100)
+
+# Spacing (in SVG units) between samples along a curve, and the cap per segment
+_SAMPLE_SPACING = 2.0
+_MAX_SAMPLES = 100
+
+_T_CACHE = {}
+
+def _n_samples(approx_len):
+    """
+    Sample count adapted to a segment's approximate length: short or
+    straight segments get a handful of points instead of the full 100.
+    The floor of 3 keeps even a single-segment path ring-buildable.
+    """
+    return max(3, min(_MAX_SAMPLES, int(approx_len / _SAMPLE_SPACING)))
+
+def _t_samples(n):
+    cached = _T_CACHE.get(n)
+    if cached is None:
+        t = np.linspace(0.0, 1.0, n)
+        cached = (t, 1.0 - t)
+        _T_CACHE[n] = cached
+    return cached
+
+if njit is not None:
+    # Tiny compiled kernels: per-segment arrays are small, so the Python/NumPy
+    # dispatch overhead dominates and a scalar loop compiled once wins big
+    @njit(cache=True)
+    def _eval_cubic(p0, p1, p2, p3, n):
+        out = np.empty(n, dtype=np.complex128)
+        for i in range(n):
+            t = i / (n - 1)
+            u = 1.0 - t
+            out[i] = u * u * u * p0 + 3.0 * u * u * t * p1 + 3.0 * u * t * t * p2 + t * t * t * p3
+        return out
+
+    @njit(cache=True)
+    def _eval_quad(p0, p1, p2, n):
+        out = np.empty(n, dtype=np.complex128)
+        for i in range(n):
+            t = i / (n - 1)
+            u = 1.0 - t
+            out[i] = u * u * p0 + 2.0 * u * t * p1 + t * t * p2
+        return out
+
+    # Warm up once at import so the first segment doesn't pay for compilation
+    _eval_cubic(0j, 0j, 1j, 1 + 1j, 2)
+    _eval_quad(0j, 1j, 1 + 1j, 2)
+else:
+    def _eval_cubic(p0, p1, p2, p3, n):
+        t, u = _t_samples(n)
+        return (u ** 3) * p0 + 3.0 * (u ** 2) * t * p1 + 3.0 * u * (t ** 2) * p2 + (t ** 3) * p3
+
+    def _eval_quad(p0, p1, p2, n):
+        t, u = _t_samples(n)
+        return (u ** 2) * p0 + 2.0 * u * t * p1 + (t ** 2) * p2
+
+# Shape-bearing tags (namespaced and bare) checked with one set lookup per element
+_SHAPE_TAGS = frozenset(
+    tag for name in ("path", "rect", "circle", "ellipse", "polygon", "polyline")
+    for tag in (name, f"{{{SVG_NS}}}{name}")
+)
+
+_CMD_RE = re.compile(r'([MmLlHhVvCcSsQqTtZzAa])')
+_FLOAT_RE = re.compile(r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?')
+
+def _tokenize_d(d):
+    """Split an SVG path `d` string into (command, [floats]) tuples."""
+    tokens = []
+    for part in _CMD_RE.split(d):
+        part = part.strip()
+        if not part:
+            continue
+        if _CMD_RE.fullmatch(part):
+            tokens.append((part, []))
+        elif tokens:
+            tokens[-1][1].extend(float(v) for v in _FLOAT_RE.findall(part))
+    return tokens
+
+# Parameters consumed per command repetition
+_CMD_ARITY = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2}
+
+def sample_path_points(d):
+    """
+    Sample an SVG path `d` attribute directly into an (N, 2) float array
+    without going through svgpathtools segment objects. Standard
+    move/line/cubic/quadratic commands get one vectorized Bezier
+    evaluation each; paths containing arcs fall back to svgpathtools.
+    """
+    tokens = _tokenize_d(d)
+    if any(cmd in ("A", "a") for cmd, _ in tokens):
+        path = parse_path(d)
+        return np.vstack([sample_segment_points(seg) for seg in path])
+
+    pieces = []
+    cur = 0j
+    start = 0j
+    prev_cubic_ctrl = None
+    prev_quad_ctrl = None
+
+    for cmd, vals in tokens:
+        rel = cmd.islower()
+        C = cmd.upper()
+
+        if C == "Z":
+            if cur != start:
+                pieces.append(np.array([cur, start]))
+            cur = start
+            prev_cubic_ctrl = prev_quad_ctrl = None
+            continue
+
+        arity = _CMD_ARITY[C]
+        for i in range(0, len(vals) - arity + 1, arity):
+            chunk = vals[i:i + arity]
+            off = cur if rel else 0j
+
+            if C == "M":
+                end = complex(chunk[0], chunk[1]) + off
+                if i == 0:
+                    cur = start = end
+                else:  # extra pairs after a moveto are implicit linetos
+                    pieces.append(np.array([cur, end]))
+                    cur = end
+                prev_cubic_ctrl = prev_quad_ctrl = None
+            elif C == "L":
+                end = complex(chunk[0], chunk[1]) + off
+                pieces.append(np.array([cur, end]))
+                cur = end
+                prev_cubic_ctrl = prev_quad_ctrl = None
+            elif C == "H":
+                end = complex(chunk[0] + (cur.real if rel else 0.0), cur.imag)
+                pieces.append(np.array([cur, end]))
+                cur = end
+                prev_cubic_ctrl = prev_quad_ctrl = None
+            elif C == "V":
+                end = complex(cur.real, chunk[0] + (cur.imag if rel else 0.0))
+                pieces.append(np.array([cur, end]))
+                cur = end
+                prev_cubic_ctrl = prev_quad_ctrl = None
+            elif C in ("C", "S"):
+                if C == "C":
+                    c1 = complex(chunk[0], chunk[1]) + off
+                    c2 = complex(chunk[2], chunk[3]) + off
+                    end = complex(chunk[4], chunk[5]) + off
+                else:
+                    c1 = 2 * cur - prev_cubic_ctrl if prev_cubic_ctrl is not None else cur
+                    c2 = complex(chunk[0], chunk[1]) + off
+                    end = complex(chunk[2], chunk[3]) + off
+                n = _n_samples(abs(c1 - cur) + abs(c2 - c1) + abs(end - c2))
+                pieces.append(_eval_cubic(cur, c1, c2, end, n))
+                prev_cubic_ctrl = c2
+                prev_quad_ctrl = None
+                cur = end
+            elif C in ("Q", "T"):
+                if C == "Q":
+                    c1 = complex(chunk[0], chunk[1]) + off
+                    end = complex(chunk[2], chunk[3]) + off
+                else:
+                    c1 = 2 * cur - prev_quad_ctrl if prev_quad_ctrl is not None else cur
+                    end = complex(chunk[0], chunk[1]) + off
+                n = _n_samples(abs(c1 - cur) + abs(end - c1))
+                pieces.append(_eval_quad(cur, c1, end, n))
+                prev_quad_ctrl = c1
+                prev_cubic_ctrl = None
+                cur = end
+
+    if not pieces:
+        return np.empty((0, 2))
+    pts = np.concatenate(pieces)
+    return np.column_stack([pts.real, pts.imag])
+
+def sample_segment_points(seg):
+    """
+    Evaluate one svgpathtools segment at all sample positions with a single
+    kernel call and return the points as an (N, 2) float array.
+    """
+    if isinstance(seg, CubicBezier):
+        n = _n_samples(abs(seg.control1 - seg.start)
+                       + abs(seg.control2 - seg.control1)
+                       + abs(seg.end - seg.control2))
+        pts = _eval_cubic(seg.start, seg.control1, seg.control2, seg.end, n)
+    elif isinstance(seg, QuadraticBezier):
+        n = _n_samples(abs(seg.control - seg.start) + abs(seg.end - seg.control))
+        pts = _eval_quad(seg.start, seg.control, seg.end, n)
+    elif isinstance(seg, Line):
+        pts = np.array([seg.start, seg.end])
+    else:
+        # Arcs and other exotic segments: fall back to per-point evaluation
+        pts = np.array([seg.point(tv) for tv in _T_SAMPLE])
+    return np.column_stack([pts.real, pts.imag])
+
+# Hand-rolled color parsing: hex, rgb()/rgba() and the CSS named colors,
+# without routing every call through matplotlib's conversion machinery
+_HEX_RE = re.compile(r'^#([0-9a-f]{3}|[0-9a-f]{6}|[0-9a-f]{8})$')
+_RGB_RE = re.compile(r'^rgba?\(\s*([\d.]+)[,\s]+([\d.]+)[,\s]+([\d.]+)(?:[,\s/]+([\d.]+))?\s*\)$')
+
+_NAMED_COLORS = {
+    "aliceblue": "#f0f8ff", "antiquewhite": "#faebd7", "aqua": "#00ffff",
+    "aquamarine": "#7fffd4", "azure": "#f0ffff", "beige": "#f5f5dc",
+    "bisque": "#ffe4c4", "black": "#000000", "blanchedalmond": "#ffebcd",
+    "blue": "#0000ff", "blueviolet": "#8a2be2", "brown": "#a52a2a",
+    "burlywood": "#deb887", "cadetblue": "#5f9ea0", "chartreuse": "#7fff00",
+    "chocolate": "#d2691e", "coral": "#ff7f50", "cornflowerblue": "#6495ed",
+    "cornsilk": "#fff8dc", "crimson": "#dc143c", "cyan": "#00ffff",
+    "darkblue": "#00008b", "darkcyan": "#008b8b", "darkgoldenrod": "#b8860b",
+    "darkgray": "#a9a9a9", "darkgreen": "#006400", "darkgrey": "#a9a9a9",
+    "darkkhaki": "#bdb76b", "darkmagenta": "#8b008b", "darkolivegreen": "#556b2f",
+    "darkorange": "#ff8c00", "darkorchid": "#9932cc", "darkred": "#8b0000",
+    "darksalmon": "#e9967a", "darkseagreen": "#8fbc8f", "darkslateblue": "#483d8b",
+    "darkslategray": "#2f4f4f", "darkslategrey": "#2f4f4f", "darkturquoise": "#00ced1",
+    "darkviolet": "#9400d3", "deeppink": "#ff1493", "deepskyblue": "#00bfff",
+    "dimgray": "#696969", "dimgrey": "#696969", "dodgerblue": "#1e90ff",
+    "firebrick": "#b22222", "floralwhite": "#fffaf0", "forestgreen": "#228b22",
+    "fuchsia": "#ff00ff", "gainsboro": "#dcdcdc", "ghostwhite": "#f8f8ff",
+    "gold": "#ffd700", "goldenrod": "#daa520", "gray": "#808080",
+    "green": "#008000", "greenyellow": "#adff2f", "grey": "#808080",
+    "honeydew": "#f0fff0", "hotpink": "#ff69b4", "indianred": "#cd5c5c",
+    "indigo": "#4b0082", "ivory": "#fffff0", "khaki": "#f0e68c",
+    "lavender": "#e6e6fa", "lavenderblush": "#fff0f5", "lawngreen": "#7cfc00",
+    "lemonchiffon": "#fffacd", "lightblue": "#add8e6", "lightcoral": "#f08080",
+    "lightcyan": "#e0ffff", "lightgoldenrodyellow": "#fafad2", "lightgray": "#d3d3d3",
+    "lightgreen": "#90ee90", "lightgrey": "#d3d3d3", "lightpink": "#ffb6c1",
+    "lightsalmon": "#ffa07a", "lightseagreen": "#20b2aa", "lightskyblue": "#87cefa",
+    "lightslategray": "#778899", "lightslategrey": "#778899", "lightsteelblue": "#b0c4de",
+    "lightyellow": "#ffffe0", "lime": "#00ff00", "limegreen": "#32cd32",
+    "linen": "#faf0e6", "magenta": "#ff00ff", "maroon": "#800000",
+    "mediumaquamarine": "#66cdaa", "mediumblue": "#0000cd", "mediumorchid": "#ba55d3",
+    "mediumpurple": "#9370db", "mediumseagreen": "#3cb371", "mediumslateblue": "#7b68ee",
+    "mediumspringgreen": "#00fa9a", "mediumturquoise": "#48d1cc", "mediumvioletred": "#c71585",
+    "midnightblue": "#191970", "mintcream": "#f5fffa", "mistyrose": "#ffe4e1",
+    "moccasin": "#ffe4b5", "navajowhite": "#ffdead", "navy": "#000080",
+    "oldlace": "#fdf5e6", "olive": "#808000", "olivedrab": "#6b8e23",
+    "orange": "#ffa500", "orangered": "#ff4500", "orchid": "#da70d6",
+    "palegoldenrod": "#eee8aa", "palegreen": "#98fb98", "paleturquoise": "#afeeee",
+    "palevioletred": "#db7093", "papayawhip": "#ffefd5", "peachpuff": "#ffdab9",
+    "peru": "#cd853f", "pink": "#ffc0cb", "plum": "#dda0dd",
+    "powderblue": "#b0e0e6", "purple": "#800080", "rebeccapurple": "#663399",
+    "red": "#ff0000", "rosybrown": "#bc8f8f", "royalblue": "#4169e1",
+    "saddlebrown": "#8b4513", "salmon": "#fa8072", "sandybrown": "#f4a460",
+    "seagreen": "#2e8b57", "seashell": "#fff5ee", "sienna": "#a0522d",
+    "silver": "#c0c0c0", "skyblue": "#87ceeb", "slateblue": "#6a5acd",
+    "slategray": "#708090", "slategrey": "#708090", "snow": "#fffafa",
+    "springgreen": "#00ff7f", "steelblue": "#4682b4", "tan": "#d2b48c",
+    "teal": "#008080", "thistle": "#d8bfd8", "tomato": "#ff6347",
+    "turquoise": "#40e0d0", "violet": "#ee82ee", "wheat": "#f5deb3",
+    "white": "#ffffff", "whitesmoke": "#f5f5f5", "yellow": "#ffff00",
+    "yellowgreen": "#9acd32",
+}
+
 def parse_svg_color_to_rgba(color_str):
-    try:
-        rgba = to_rgba(color_str)  # Returns (r, g, b, a) as 0–1 floats
-        r, g, b, a = [round(v * 255) if i < 3 else round(v, 2) for i, v in enumerate(rgba)]
-        return f"rgba({r}, {g}, {b}, {a})"
-    except Exception:
+    if not color_str:
         return None
+    color = color_str.strip().lower()
+    if color == "none":
+        return "rgba(0, 0, 0, 0.0)"
+    color = _NAMED_COLORS.get(color, color)
 
+    match = _HEX_RE.match(color)
+    if match:
+        hex_digits = match.group(1)
+        if len(hex_digits) == 3:
+            r, g, b = (int(c * 2, 16) for c in hex_digits)
+            a = 1.0
+        else:
+            r, g, b = (int(hex_digits[i:i + 2], 16) for i in (0, 2, 4))
+            a = round(int(hex_digits[6:8], 16) / 255, 2) if len(hex_digits) == 8 else 1.0
+        return f"rgba({r}, {g}, {b}, {a})"
+
+    match = _RGB_RE.match(color)
+    if match:
+        r, g, b = (round(float(v)) for v in match.group(1, 2, 3))
+        a = round(float(match.group(4)), 2) if match.group(4) else 1.0
+        return f"rgba({r}, {g}, {b}, {a})"
+
+    return None
 
-def parse_polygon_from_svg(svg_path):
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
 
-    # Parse <style> blocks (handles both <style> and <svg:style>)
+def parse_polygon_from_svg(svg_path):
+    # Streaming pass over <style> blocks only (handles both <style> and <svg:style>)
     style_map = {}
-    styles = root.findall(".//{http://www.w3.org/2000/svg}style") or root.findall(".//style")
-    for style_el in styles:
+    for _, style_el in etree.iterparse(str(svg_path), events=("end",), tag=(f"{{{SVG_NS}}}style", "style")):
         style_text = style_el.text
         if style_text:
-            for line in style_text.split("}"):
-                if "{" in line:
-                    selector, block = line.split("{", 1)
-                    props = dict(
-                        pair.split(":") for pair in block.strip().strip(";").split(";") if ":" in pair
-                    )
-                    fill = props.get("fill")
-                    if fill:
-                        # Support multiple class selectors per rule
-                        selectors = selector.strip().split(",")
-                        for sel in selectors:
-                            sel = sel.strip().lstrip(".").split(":")[0]
-                            style_map[sel] = fill.strip()
-
-    for el in root.iter():
+            for rule in _CSS_RULE_RE.finditer(style_text):
+                selector, block = rule.group(1), rule.group(2)
+                props = dict(
+                    pair.split(":") for pair in block.strip().strip(";").split(";") if ":" in pair
+                )
+                fill = props.get("fill")
+                if fill:
+                    # Support multiple class selectors per rule
+                    selectors = selector.strip().split(",")
+                    for sel in selectors:
+                        sel = sel.strip().lstrip(".").split(":")[0]
+                        style_map[sel] = fill.strip()
+        style_el.clear()
+
+    # Stream the document and return at the first shape-bearing element;
+    # clear() keeps memory bounded on heavily layered SVGs
+    for _, el in etree.iterparse(str(svg_path), events=("end",)):
+        if not isinstance(el.tag, str):
+            continue  # skip comments / processing instructions
         tag = el.tag.lower()
+        if tag not in _SHAPE_TAGS:
+            el.clear()
+            continue  # skip style/defs/group/text nodes without attribute checks
         raw_color = el.attrib.get("fill")
 
         if not raw_color:
@@ -87,10 +374,16 @@ def parse_polygon_from_svg(svg_path):
 
         # Create polygon shape
         if 'd' in el.attrib:  # path
-            path = parse_path(el.attrib['d'])
-            points = [seg.point(t) for seg in path for t in np.linspace(0, 1, 100)]
-            coords = [(pt.real, pt.imag) for pt in points]
-            return Polygon(coords).buffer(0), color
+            coords = sample_path_points(el.attrib['d'])
+            if len(coords) < 3:
+                # Degenerate sliver: same empty polygon the fixed-count
+                # sampling produced, so the caller skips it instead of
+                # dying on the linearring minimum
+                return Polygon(), color
+            polygon = Polygon(coords)
+            if not polygon.is_valid:
+                polygon = polygon.buffer(0)  # only repair self-intersecting paths
+            return polygon, color
 
         elif tag.endswith("rect"):
             x = float(el.attrib.get("x", 0))
@@ -116,12 +409,44 @@ def parse_polygon_from_svg(svg_path):
             points_str = el.attrib.get("points", "")
             try:
                 points = [tuple(map(float, p.split(","))) for p in points_str.strip().split()]
-                return Polygon(points).buffer(0), color
+                polygon = Polygon(points)
+                if not polygon.is_valid:
+                    polygon = polygon.buffer(0)
+                return polygon, color
             except:
-                continue
+                pass
+
+        el.clear()
 
     return None, None
 
+def load_polygon_cached(svg_path):
+    """
+    Parse an SVG's polygon and color, backed by a WKB + metadata cache next
+    to the file. Segment SVGs never change, so repeated hierarchy runs can
+    skip the XML parse and Bezier sampling entirely; the cache is
+    invalidated by mtime if the SVG is ever rewritten.
+    """
+    wkb_path = svg_path.with_suffix(".wkb")
+    meta_path = svg_path.with_suffix(".meta.json")
+    try:
+        if (wkb_path.exists() and meta_path.exists()
+                and wkb_path.stat().st_mtime >= svg_path.stat().st_mtime):
+            polygon = shapely.from_wkb(wkb_path.read_bytes())
+            color = orjson.loads(meta_path.read_bytes()).get("color")
+            return polygon, color
+    except Exception as e:
+        print(f"⚠️ Ignoring stale polygon cache for {svg_path.name}: {e}")
+
+    polygon, color = parse_polygon_from_svg(svg_path)
+    if polygon is not None:
+        try:
+            wkb_path.write_bytes(shapely.to_wkb(polygon))
+            meta_path.write_bytes(orjson.dumps({"color": color}))
+        except OSError as e:
+            print(f"⚠️ Could not write polygon cache for {svg_path.name}: {e}")
+    return polygon, color
+
 def load_all_segments(*segment_dirs):
     segments = []
     idx = 0
@@ -133,12 +458,15 @@ def load_all_segments(*segment_dirs):
         )
 
         for svg_path in segment_paths:
-            polygon, color = parse_polygon_from_svg(svg_path)
+            polygon, color = load_polygon_cached(svg_path)
             if polygon and polygon.is_valid:
                 segments.append({
                     "id": idx,
                     "filename": svg_path.name,
                     "polygon": polygon,
+                    # Coarser copy used for containment queries only; parent
+                    # assignment needs rough containment, not edge fidelity
+                    "query_polygon": polygon.simplify(SIMPLIFY_TOLERANCE, preserve_topology=False),
                     "color": color,
                 })
                 idx += 1
@@ -150,88 +478,110 @@ def build_hierarchy(segments):
     Assigns the most suitable parent for each segment based on geometric containment,
     considering both layers and elements as potential parents.
     """
-    for seg in segments:
-        seg["parent"] = -1  # Initialize all as root
+    # SoA layout for the hot loop: geometries in one list, scalars in arrays
+    polygons = [seg["query_polygon"] for seg in segments]
+    ids = np.array([seg["id"] for seg in segments], dtype=np.int64)
+    parents = np.full(len(segments), -1, dtype=np.int64)  # all roots by default
+
+    # Partitioned envelope indexes: layers are the common parents and form a
+    # much smaller tree than the per-element segments
+    layer_pos = np.array(
+        [i for i, seg in enumerate(segments) if "Layer" in seg["filename"]], dtype=np.intp
+    )
+    elem_pos = np.array(
+        [i for i, seg in enumerate(segments) if "Layer" not in seg["filename"]], dtype=np.intp
+    )
+    layer_tree = STRtree([polygons[i] for i in layer_pos]) if layer_pos.size else None
+    elem_tree = STRtree([polygons[i] for i in elem_pos]) if elem_pos.size else None
+
+    # SoA caches: one bounds/area call per polygon instead of one per pair
+    bounds = np.array([poly.bounds for poly in polygons])  # (minx, miny, maxx, maxy)
+    areas = np.array([poly.area for poly in polygons])
+
+    # Prepare in place so the contains() ufunc reuses the edge indexes
+    polys_arr = np.array(polygons, dtype=object)
+    shapely.prepare(polys_arr)
+
+    for i in range(len(segments)):
+        cand_parts = []
+        if layer_tree is not None:
+            cand_parts.append(layer_pos[layer_tree.query(polygons[i])])
+        if elem_tree is not None:
+            cand_parts.append(elem_pos[elem_tree.query(polygons[i])])
+        candidates = np.concatenate(cand_parts) if cand_parts else np.empty(0, dtype=np.intp)
+        if candidates.size == 0:
+            continue
 
-    for inner in segments:
-        best_parent = None
-        best_area = float("inf")
+        # Vectorized AABB prefilter: outer bbox must enclose inner bbox
+        minx, miny, maxx, maxy = bounds[i]
+        bbox_inside = (
+            (bounds[candidates, 0] <= minx) & (bounds[candidates, 1] <= miny) &
+            (bounds[candidates, 2] >= maxx) & (bounds[candidates, 3] >= maxy) &
+            (areas[candidates] >= areas[i]) & (candidates != i)
+        )
+        candidates = candidates[bbox_inside]
+        if candidates.size == 0:
+            continue
 
-        for outer in segments:
-            if outer["id"] == inner["id"]:
-                continue
-            # Check if outer fully contains inner
-            if outer["polygon"].contains(inner["polygon"]):
-                area = outer["polygon"].area
-                if area < best_area:
-                    best_area = area
-                    best_parent = outer["id"]
+        # Refine all survivors with one C-level contains() call
+        contains_mask = shapely.contains(polys_arr[candidates], polygons[i])
+        containers = candidates[contains_mask]
+        if containers.size:
+            best = containers[np.argmin(areas[containers])]
+            parents[i] = ids[best]
 
-        if best_parent is not None:
-            inner["parent"] = best_parent
+    # Write results back into the dicts in one pass
+    for i, seg in enumerate(segments):
+        seg["parent"] = int(parents[i])
 
     return segments
 
-def load_gemini_responses(svg_name: str):
-    response_path = RESPONSES_DIR / svg_name / "response.json"
-    
-    if not response_path.exists():
-        print(f"❌ No response.json found at {response_path}")
-        return []
-
-    with open(response_path) as f:
-        try:
-            responses = json.load(f)
-        except json.JSONDecodeError:
-            print(f"❌ Invalid JSON format in {response_path}")
-            return []
-
-    result = []
-    for entry in responses:
-        result.append({
-            "mask_path": entry.get("id"),           # filename of the PNG
-            "description": entry.get("description") # descriptive text
-        })
-
-    return result
-
-def export_hierarchy_json(segments, output_path, svg_name):
-    # Load Gemini responses
+def load_scene_context(svg_name: str):
+    """
+    Load the Gemini response data and the scene's global style/description
+    in one place, so each subfolder reads its JSON files exactly once.
+    Returns (gemini_data, global_style, description).
+    """
     response_path = RESPONSES_DIR / svg_name / "response.json"
     metadata_path = RESPONSES_DIR / svg_name / "scene_metadata.json"
 
-    # Load segmented element responses
     gemini_data = []
     if response_path.exists():
-        with open(response_path) as f:
-            try:
-                gemini_data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"❌ Invalid JSON format in {response_path}")
+        try:
+            gemini_data = orjson.loads(response_path.read_bytes())
+        except orjson.JSONDecodeError:
+            print(f"❌ Invalid JSON format in {response_path}")
 
-    # Load global style + description from metadata
     global_style = ""
     description = ""
     if metadata_path.exists():
         try:
-            with open(metadata_path) as f:
-                metadata = json.load(f)
-                global_style = metadata.get("global_style", "")
-                description = metadata.get("description", "")
+            metadata = orjson.loads(metadata_path.read_bytes())
+            global_style = metadata.get("global_style", "")
+            description = metadata.get("description", "")
         except Exception as e:
             print(f"⚠️ Failed to load scene metadata from {metadata_path}: {e}")
 
+    return gemini_data, global_style, description
 
-    # Index gemini data by full filename
+def export_hierarchy_json(segments, output_path, svg_name, context):
+    gemini_data, global_style, description = context
+
+    # Index gemini data under both the filename stem and the numeric index in
+    # one pass, so either lookup style in the segment loop stays O(1)
     gemini_index = {}
     for entry in gemini_data:
         raw_filename = entry.get("mask_path") or entry.get("id")
         if raw_filename:
-            key = Path(raw_filename).stem.replace("_highlighted", "")  # e.g. "Layer 96"
-            gemini_index[key] = {
+            value = {
                 "mask_path": raw_filename,
                 "description": entry.get("description")
             }
+            key = Path(raw_filename).stem.replace("_highlighted", "")  # e.g. "Layer 96"
+            gemini_index[key] = value
+            idx = extract_index_from_filename(raw_filename)
+            if idx != -1:
+                gemini_index[idx] = value
 
 
     # Shift all IDs by +1 to leave 0 for full SVG
@@ -239,16 +589,6 @@ def export_hierarchy_json(segments, output_path, svg_name):
         seg["id"] += 1
         seg["parent"] = seg["parent"] + 1 if seg["parent"] != 0 else 0  # remap parents
 
-    result = []
-
-    # ID 0 is the full image
-    result.append({
-        "id": 0,
-        "filename": "Full " + svg_name,
-        "parent": -1,
-        "description": description,
-    })
-
     sorted_segments = sorted(segments, key=sort_key)
 
     # Reassign IDs based on new order (starting from 1)
@@ -267,31 +607,59 @@ def export_hierarchy_json(segments, output_path, svg_name):
         else:
             seg["parent"] = -1  # orphan fallback
 
-    # segmented shapes
-    for seg in sorted_segments:
-        key = Path(seg["filename"]).stem
-        gemini = gemini_index.get(key, {})
-
-
-        # idx = extract_index_from_filename(seg["filename"])
-        # gemini = gemini_index.get(idx, {})
-        result.append({
-            "id": seg["id"],
-            "filename": seg["filename"],
-            "parent": seg["parent"],
-            "mask_path": gemini.get("mask_path", None),
-            "description": gemini.get("description", None),
-            "color": seg["color"]
-        })
-
-    final_output = {
-        "global_style": global_style,
-        "scene": result
-    }
-
+    # Stream the output record by record instead of materializing the full
+    # scene list; ID 0 is the full image
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(final_output, f, indent=2)
+    with open(output_path, "wb") as f:
+        f.write(b'{"global_style":' + orjson.dumps(global_style) + b',"scene":[')
+        f.write(orjson.dumps({
+            "id": 0,
+            "filename": "Full " + svg_name,
+            "parent": -1,
+            "description": description,
+        }))
+
+        # segmented shapes
+        for seg in sorted_segments:
+            key = Path(seg["filename"]).stem
+            gemini = gemini_index.get(key)
+            if gemini is None:
+                gemini = gemini_index.get(extract_index_from_filename(seg["filename"]), {})
+
+            f.write(b",")
+            f.write(orjson.dumps({
+                "id": seg["id"],
+                "filename": seg["filename"],
+                "parent": seg["parent"],
+                "mask_path": gemini.get("mask_path", None),
+                "description": gemini.get("description", None),
+                "color": seg["color"]
+            }))
+
+        f.write(b"]}")
+
+def process_subfolder(svg_dir, selected_folder):
+    """
+    Process one segment subfolder end to end (load, hierarchy, export).
+    Runs inside a worker process, so each call loads its own segments.
+    """
+    plus_folder = SEGMENTS_PLUS_DIR / svg_dir.name
+    if plus_folder.exists() and plus_folder.is_dir():
+        segments = load_all_segments(svg_dir, plus_folder)
+    else:
+        segments = load_all_segments(svg_dir)
+
+    if not segments:
+        print(f"⚠️ No valid SVGs in {svg_dir.name}")
+        return None
+
+    segments_with_parents = build_hierarchy(segments)
+
+    svg_name = svg_dir.name
+    context = load_scene_context(svg_name)
+    output_json_path = OUTPUT_ROOT / selected_folder / f"{svg_name}_hierarchy.json"
+    export_hierarchy_json(segments_with_parents, output_json_path, svg_name, context)
+    return output_json_path
 
 def main():
     # Step 1: Prompt user to select folder
@@ -311,29 +679,16 @@ def main():
     selected_folder = answers["selected_folder"]
     selected_folder_path = SEGMENTS_DIR / selected_folder
 
-    # Step 2: Process each subfolder inside selected
+    # Step 2: Process each subfolder inside selected, one worker per core
     subfolders = [d for d in selected_folder_path.iterdir() if d.is_dir()]
-    for svg_dir in tqdm(subfolders, desc="Processing folders", unit="folder"):
-        print(f"\n📂 Processing: {svg_dir.name}")
-
-        plus_folder = SEGMENTS_PLUS_DIR / svg_dir.name
-        if plus_folder.exists() and plus_folder.is_dir():
-            print(f"➕ Also loading segments from: {plus_folder}")
-            segments = load_all_segments(svg_dir, plus_folder)
-        else:
-            segments = load_all_segments(svg_dir)
-
-        if not segments:
-            print(f"⚠️ No valid SVGs in {svg_dir.name}")
-            continue
-
-        segments_with_parents = build_hierarchy(segments)
-
-        svg_name = svg_dir.name 
-        output_json_path = OUTPUT_ROOT / selected_folder / f"{svg_name}_hierarchy.json"
-        export_hierarchy_json(segments_with_parents, output_json_path, svg_name)
-
-        tqdm.write(f"✅ Saved: {output_json_path}")
+    worker = partial(process_subfolder, selected_folder=selected_folder)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for output_json_path in tqdm(
+            executor.map(worker, subfolders),
+            total=len(subfolders), desc="Processing folders", unit="folder"
+        ):
+            if output_json_path is not None:
+                tqdm.write(f"✅ Saved: {output_json_path}")
 
 if __name__ == "__main__":
     main()
@@ -2,10 +2,28 @@
 #!/usr/bin/env python3
 
 import os
+import json
+import gzip
+import base64
 import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import inquirer
 
+def _read_text(path):
+    try:
+        return path.read_text(encoding='utf-8')
+    except Exception as e:
+        print(f"⚠️ Failed to read {path.name}: {e}")
+        return None
+
+def _embed_payload(svg_content):
+    """Gzip + base64 an SVG string: XML compresses 5-10x, shrinking the
+    generated HTML accordingly; the page inflates it with
+    DecompressionStream on demand."""
+    compressed = gzip.compress(svg_content.encode('utf-8'), compresslevel=6)
+    return base64.b64encode(compressed).decode('ascii')
+
 def extract_segments_info(segments_dir, originals_dir, folder_name):
     segments_map = {}
     originals_map = {}
@@ -14,8 +32,18 @@ def extract_segments_info(segments_dir, originals_dir, folder_name):
     if not segments_path.exists():
         return segments_map, originals_map
 
-    # Search all top-level folders for originals
+    # Index all originals once (stem -> path) so each segment folder is a
+    # dict lookup instead of a rescan of every top-level folder
     originals_base_path = Path(originals_dir).parent
+    originals_index = {}
+    with os.scandir(originals_base_path) as folders:
+        for folder in folders:
+            if not folder.is_dir(follow_symlinks=False):
+                continue
+            with os.scandir(folder.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.svg'):
+                        originals_index.setdefault(entry.name[:-4], Path(entry.path).resolve())
 
     # Find all segment subfolders (each representing an original SVG)
     for subdir in segments_path.iterdir():
@@ -23,21 +51,17 @@ def extract_segments_info(segments_dir, originals_dir, folder_name):
             continue
 
         segment_list = []
-        for file in subdir.glob('*.svg'):
-            segment_list.append(file.resolve())
+        with os.scandir(subdir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.svg'):
+                    segment_list.append(Path(entry.path).resolve())
         if segment_list:
             segments_map[subdir.name] = segment_list
 
-            # Search all top-level folders for the matching original SVG
-            found_original = False
-            for potential_folder in originals_base_path.iterdir():
-                if potential_folder.is_dir():
-                    candidate = potential_folder / f"{subdir.name}.svg"
-                    if candidate.exists():
-                        originals_map[subdir.name] = candidate.resolve()
-                        found_original = True
-                        break
-            if not found_original:
+            original = originals_index.get(subdir.name)
+            if original is not None:
+                originals_map[subdir.name] = original
+            else:
                 print(f"⚠️ Original SVG not found for: {subdir.name}")
 
     return segments_map, originals_map
@@ -45,7 +69,10 @@ def extract_segments_info(segments_dir, originals_dir, folder_name):
 def create_offline_preview(segments_dir, originals_dir, folder_name, output_html):
     segments_map, originals_map = extract_segments_info(segments_dir, originals_dir, folder_name)
 
-    html_content = """
+    # Stream straight to disk with a large write buffer: peak memory stays
+    # at one SVG plus the I/O buffer instead of the whole document
+    out = open(output_html, 'w', encoding='utf-8', buffering=1 << 20)
+    out.write("""
 <!DOCTYPE html>
 <html>
 <head>
@@ -172,18 +199,18 @@ def create_offline_preview(segments_dir, originals_dir, folder_name, output_html
         <div class="navigation">
             <h2>Original SVGs</h2>
             <ul class="svg-list">
-    """
+    """)
 
     # Add original SVG buttons
     for idx, original_name in enumerate(sorted(segments_map.keys()), 1):
         if original_name in originals_map:
-            html_content += f"""
+            out.write(f"""
                 <li>
                     <button onclick="loadOriginal('{original_name}')">{idx}. {original_name}</button>
                 </li>
-            """
+            """)
 
-    html_content += """
+    out.write("""
             </ul>
         </div>
         <div class="content">
@@ -205,40 +232,53 @@ def create_offline_preview(segments_dir, originals_dir, folder_name, output_html
         const originals = {};
         const segments = {};
         const segmentNames = {};
-    """
-
-    # Embed originals
-    for name, path in originals_map.items():
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                svg_content = f.read().replace('\n', '').replace('"', '\\"')
-                html_content += f'originals["{name}"] = "{svg_content}";\n'
-        except Exception as e:
-            print(f"⚠️ Failed to embed original {name}: {e}")
-
-    # Embed segments and their names
-    for name, files in segments_map.items():
-        html_content += f'segments["{name}"] = [];\n'
-        html_content += f'segmentNames["{name}"] = [];\n'
-        for file in files:
-            try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    svg_content = f.read().replace('\n', '').replace('"', '\\"')
-                    file_name = file.stem
-                    html_content += f'segments["{name}"].push("{svg_content}");\n'
-                    html_content += f'segmentNames["{name}"].push("{file_name}");\n'
-            except Exception as e:
-                print(f"⚠️ Failed to embed segment for {name}: {e}")
-
-    html_content += """
+    """)
+
+    # Issue all reads through the pool in embedding order and consume the
+    # results lazily, so I/O overlaps the writes without holding every file
+    all_paths = list(originals_map.values())
+    all_paths.extend(f for files in segments_map.values() for f in files)
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        contents = executor.map(_read_text, all_paths)
+
+        # Embed originals
+        for name, path in originals_map.items():
+            svg_content = next(contents)
+            if svg_content is None:
+                print(f"⚠️ Failed to embed original {name}")
+                continue
+            out.write(f'originals["{name}"] = "{_embed_payload(svg_content)}";\n')
+
+        # Embed segments and their names; names go out as one JSON array
+        # literal per original instead of one push statement per file
+        for name, files in segments_map.items():
+            out.write(f'segments["{name}"] = [];\n')
+            names = []
+            for file in files:
+                svg_content = next(contents)
+                if svg_content is None:
+                    print(f"⚠️ Failed to embed segment for {name}")
+                    continue
+                out.write(f'segments["{name}"].push("{_embed_payload(svg_content)}");\n')
+                names.append(file.stem)
+            out.write(f'segmentNames["{name}"] = {json.dumps(names)};\n')
+
+    out.write("""
         let currentOriginal = null;
         let currentIndex = -1;
+        const segmentCache = new Map();  // originalName/index -> highlight group
 
-        function loadOriginal(name) {
+        async function inflate(b64) {
+            const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+            const stream = new Response(bytes).body.pipeThrough(new DecompressionStream('gzip'));
+            return await new Response(stream).text();
+        }
+
+        async function loadOriginal(name) {
             document.querySelectorAll('.svg-list button').forEach(btn => btn.classList.remove('active'));
             const btn = Array.from(document.querySelectorAll('.svg-list button')).find(b => b.textContent.includes(name));
             if (btn) btn.classList.add('active');
-            document.getElementById('original-svg-container').innerHTML = originals[name];
+            document.getElementById('original-svg-container').innerHTML = await inflate(originals[name]);
             currentOriginal = name;
             currentIndex = -1;
 
@@ -251,7 +291,7 @@ def create_offline_preview(segments_dir, originals_dir, folder_name, output_html
             document.getElementById('segment-items').innerHTML = segmentItems;
         }
 
-        function highlightSegment(index) {
+        async function highlightSegment(index) {
             if (!currentOriginal) return;
             const container = document.getElementById('original-svg-container');
             const svgElement = container.querySelector('svg');
@@ -264,19 +304,26 @@ def create_offline_preview(segments_dir, originals_dir, folder_name, output_html
             const oldHighlight = svgElement.querySelector('.highlight');
             if (oldHighlight) oldHighlight.remove();
 
-            const parser = new DOMParser();
-            const segmentDoc = parser.parseFromString(segments[currentOriginal][index], 'image/svg+xml');
-            const shapes = segmentDoc.querySelectorAll('svg > *:not(style)');
-            const highlightGroup = document.createElementNS('http://www.w3.org/2000/svg', 'g');
-            highlightGroup.setAttribute('class', 'highlight');
-            shapes.forEach(shape => {
-                const clone = shape.cloneNode(true);
-                clone.setAttribute('fill', '#ff000050');
-                clone.setAttribute('stroke', '#ff0000');
-                clone.setAttribute('stroke-width', '2');
-                highlightGroup.appendChild(clone);
-            });
-            svgElement.appendChild(highlightGroup);
+            // Inflate + parse each segment once; repeat visits clone the
+            // cached highlight group instead of re-parsing the XML
+            const cacheKey = currentOriginal + '/' + index;
+            let highlightGroup = segmentCache.get(cacheKey);
+            if (!highlightGroup) {
+                const parser = new DOMParser();
+                const segmentDoc = parser.parseFromString(await inflate(segments[currentOriginal][index]), 'image/svg+xml');
+                const shapes = segmentDoc.querySelectorAll('svg > *:not(style)');
+                highlightGroup = document.createElementNS('http://www.w3.org/2000/svg', 'g');
+                highlightGroup.setAttribute('class', 'highlight');
+                shapes.forEach(shape => {
+                    const clone = shape.cloneNode(true);
+                    clone.setAttribute('fill', '#ff000050');
+                    clone.setAttribute('stroke', '#ff0000');
+                    clone.setAttribute('stroke-width', '2');
+                    highlightGroup.appendChild(clone);
+                });
+                segmentCache.set(cacheKey, highlightGroup);
+            }
+            svgElement.appendChild(highlightGroup.cloneNode(true));
 
             // Highlight the segment item
             document.querySelectorAll('.segment-item').forEach(item => item.classList.remove('active'));
@@ -301,10 +348,9 @@ def create_offline_preview(segments_dir, originals_dir, folder_name, output_html
     </script>
 </body>
 </html>
-    """
+    """)
 
-    with open(output_html, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    out.close()
     print(f"✅ Offline HTML preview created at {output_html}")
 
 def main():
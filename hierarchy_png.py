@@ -1,14 +1,27 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
+import logging
 from pathlib import Path
-import json
+import orjson
 from tqdm import tqdm
 import cv2
 import numpy as np
 import re
 import inquirer
-import xml.etree.ElementTree as ET
-from shapely.geometry import Polygon, Point
+from lxml import etree
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; the numpy path is used instead
+    njit = None
 from collections import deque
 
+log = logging.getLogger(__name__)
+
 SEGMENTS_DIR = Path("segmented_svgs")
 SEGMENTS_DIR_PLUS = Path("segmented_svgs_plus")
 HIGHLIGHTED_DIR = Path("highlighted_pngs_no_overlay")
@@ -19,17 +32,23 @@ OUTPUT_ROOT.mkdir(exist_ok=True)
 SVG_NS = "http://www.w3.org/2000/svg"
 NSMAP = {"svg": SVG_NS}
 
+# One file per worker process is the parallelism unit; OpenCV's internal
+# thread pool only adds contention on these small images
+cv2.setNumThreads(1)
+
+# True inside a group worker: the outer pool in main() already uses every
+# core, so load_png_segments must not nest a second pool per group
+_IN_GROUP_WORKER = False
+
+_SHAPE_TAG_NAMES = {"path", "polygon", "rect", "circle", "ellipse", "polyline"}
+
+# One alternation covers all three filename styles; compiled once at import
+_IDX_RE = re.compile(r'(?:_element_|Layer[_ ]?|Item[_ ]?)(\d+)')
+
+@lru_cache(maxsize=2048)
 def extract_index_from_filename(name: str) -> int:
-    patterns = [
-        r'_element_(\d+)',
-        r'Layer[_ ]?(\d+)',
-        r'Item[_ ]?(\d+)',
-    ]
-    for pat in patterns:
-        match = re.search(pat, name)
-        if match:
-            return int(match.group(1))
-    return -1
+    match = _IDX_RE.search(name)
+    return int(match.group(1)) if match else -1
 
 def sort_key(seg):
     name = seg["filename"]
@@ -40,24 +59,25 @@ def sort_key(seg):
     else:
         return (2, extract_index_from_filename(name))
 
+# Rule and fill patterns compiled once; one findall replaces the per-block
+# split("}")/split("{")/search cascade
+_CSS_RULE_RE = re.compile(r'([^{}]+)\{([^}]*)\}')
+_CSS_FILL_RE = re.compile(r'fill\s*:\s*([^;]+)')
+
 def parse_svg_style_block(css_text: str) -> dict:
-    import re
     style_map = {}
-    for rule in css_text.split("}"):
-        if "{" not in rule:
+    for selectors, body in _CSS_RULE_RE.findall(css_text):
+        fill_match = _CSS_FILL_RE.search(body)
+        if not fill_match:
             continue
-        selector, props = rule.split("{", 1)
-        selector = selector.strip()
-        props = props.strip()
-        for class_name in selector.split(","):
-            class_name = class_name.strip().lstrip(".")
-            fill_match = re.search(r"fill\s*:\s*([^;]+)", props)
-            if fill_match:
-                style_map[class_name] = fill_match.group(1).strip()
+        fill = fill_match.group(1).strip()
+        for class_name in selectors.split(","):
+            style_map[class_name.strip().lstrip(".")] = fill
     return style_map
 
+@lru_cache(maxsize=1024)
 def parse_svg_color_to_rgba(color: str) -> str | None:
-    import re
+    # Palettes repeat heavily across segments, so most calls are cache hits
     color = color.strip().lower()
     if color.startswith("#"):
         hex = color[1:]
@@ -75,87 +95,218 @@ def parse_svg_color_to_rgba(color: str) -> str | None:
     return None  # fallback
 
 def extract_svg_fill_color(svg_path: Path) -> str | None:
+    """Memoized on (path, mtime): segment palettes repeat across groups and
+    runs within a process, so identical files skip the XML parse."""
     try:
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
+        mtime_ns = svg_path.stat().st_mtime_ns
+    except OSError:
+        return None
+    return _extract_fill_color_cached(str(svg_path), mtime_ns)
 
-        # Load CSS styles from <style> and <svg:style>
+@lru_cache(maxsize=4096)
+def _extract_fill_color_cached(svg_path: str, mtime_ns: int) -> str | None:
+    try:
         style_map = {}
-        for style_el in (
-            root.findall(".//{http://www.w3.org/2000/svg}style") +
-            root.findall(".//svg:style", namespaces=NSMAP)
-        ):
-            if style_el.text:
-                style_map.update(parse_svg_style_block(style_el.text))
 
-        def is_display_none(style: str | None) -> bool:
-            return style and "display:none" in style.replace(" ", "")
+        def is_hidden(node) -> bool:
+            # display:none on the node or any ancestor (parents are still
+            # open when a child's end event fires, so attribs are available)
+            while node is not None:
+                style = node.attrib.get("style")
+                if style and "display:none" in style.replace(" ", ""):
+                    return True
+                if node.attrib.get("display") == "none":
+                    return True
+                node = node.getparent()
+            return False
+
+        best_fill = None
+        max_score = -1
+        # Best shape whose class had no rule yet (a <style> block after the
+        # shapes); resolved against the finished style_map at the end
+        best_class = None
+        class_max_score = -1
+        gradient_last_stop = {}
+        # Once a candidate scores this high, later shapes can't matter much;
+        # quarter of the file size is a generous upper bound on a d-string
+        early_stop = os.path.getsize(svg_path) // 4
+
+        # Single streaming pass: CSS rules, gradients and shape scoring all
+        # come out of one parse, releasing memory as it goes
+        for _, node in etree.iterparse(svg_path, events=("end",)):
+            if not isinstance(node.tag, str):
+                continue
+            tag = node.tag.split("}")[-1].lower()
 
-        def strip_ns(tag: str) -> str:
-            return tag.split("}")[-1]
+            if tag == "style":
+                if node.text:
+                    style_map.update(parse_svg_style_block(node.text))
+                node.clear()
+                continue
 
-        def resolve_gradient_color(gradient_id: str) -> str | None:
-            grad = root.find(f".//*[@id='{gradient_id}']")
-            if grad is not None:
-                stops = grad.findall(f"{{{SVG_NS}}}stop") or grad.findall("stop")
-                if stops:
+            if tag in ("lineargradient", "radialgradient"):
+                grad_id = node.attrib.get("id")
+                stops = node.findall(f"{{{SVG_NS}}}stop") or node.findall("stop")
+                if grad_id and stops:
                     style = stops[-1].attrib.get("style", "")
                     for prop in style.split(";"):
                         if "stop-color" in prop:
-                            color = prop.split(":")[1].strip()
-                            return parse_svg_color_to_rgba(color)
-            return None
+                            gradient_last_stop[grad_id] = prop.split(":")[1].strip()
+                            break
+                continue
 
-        best_fill = None
-        max_score = -1
+            if tag not in _SHAPE_TAG_NAMES:
+                node.clear()
+                continue
+
+            if is_hidden(node):
+                node.clear()
+                continue
 
-        def walk(node, visible=True):
-            nonlocal best_fill, max_score
-            tag = strip_ns(node.tag).lower()
             style = node.attrib.get("style", "")
-            display_none = is_display_none(style) or node.attrib.get("display") == "none"
-            current_visible = visible and not display_none
+            fill = node.attrib.get("fill")
+
+            if not fill and "fill:" in style:
+                for prop in style.split(";"):
+                    if prop.strip().startswith("fill:"):
+                        fill = prop.split(":", 1)[1].strip()
+                        break
+
+            class_name = None
+            if not fill:
+                class_name = node.attrib.get("class", "").strip()
+                if class_name in style_map:
+                    fill = style_map[class_name]
+                    class_name = None
+
+            if (fill and fill not in ("none", "transparent")) or class_name:
+                score = len(node.attrib.get("d", "")) + len(node.attrib.get("points", ""))
+                for attr in ("width", "height", "r", "rx", "ry"):
+                    try:
+                        score += float(node.attrib.get(attr, 0))
+                    except:
+                        pass
+
+                if class_name:
+                    if score > class_max_score:
+                        best_class = class_name
+                        class_max_score = score
+                elif score > max_score:
+                    best_fill = fill
+                    max_score = score
+
+            node.clear()
+            if max_score > early_stop:
+                break
+
+        # Late-bound classes: a rule may have appeared after the shape
+        if best_class is not None and class_max_score > max_score:
+            fill = style_map.get(best_class)
+            if fill and fill not in ("none", "transparent"):
+                best_fill = fill
 
-            if current_visible and tag in {"path", "polygon", "rect", "circle", "ellipse", "polyline"}:
-                fill = node.attrib.get("fill")
+        if best_fill and best_fill.startswith("url(#"):
+            color = gradient_last_stop.get(best_fill[5:-1])
+            return parse_svg_color_to_rgba(color) if color else None
 
-                if not fill:
-                    for prop in style.split(";"):
-                        if prop.strip().startswith("fill:"):
-                            fill = prop.split(":", 1)[1].strip()
-                            break
+        return parse_svg_color_to_rgba(best_fill) if best_fill else None
 
-                if not fill:
-                    class_name = node.attrib.get("class", "").strip()
-                    if class_name in style_map:
-                        fill = style_map[class_name]
+    except Exception as e:
+        log.warning("Failed to parse %s: %s", Path(svg_path).name, e)
+        return None
 
-                if fill and fill not in ("none", "transparent"):
-                    score = len(node.attrib.get("d", "")) + len(node.attrib.get("points", ""))
-                    for attr in ("width", "height", "r", "rx", "ry"):
-                        try:
-                            score += float(node.attrib.get(attr, 0))
-                        except:
-                            pass
+def _binary_mask(image):
+    """
+    Binary foreground mask for a segment PNG. RGBA images with a real
+    alpha channel slice it directly, skipping the BGR weighted-sum pass;
+    fully opaque or 3-channel images threshold the grayscale as before.
+    inRange(11, 255) is the >10 threshold as one SIMD pass with no
+    retval/tuple unpacking.
+    """
+    if image.ndim == 2:
+        # Already single-channel (e.g. decoded with IMREAD_GRAYSCALE)
+        return cv2.inRange(image, 11, 255)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3]
+        if alpha.min() < 255:
+            return cv2.inRange(alpha, 11, 255)
+        image = image[:, :, :3]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.inRange(gray, 11, 255)
+
+def _dir_names(path: Path) -> frozenset:
+    try:
+        return frozenset(e.name for e in os.scandir(path))
+    except OSError:
+        return frozenset()
 
-                    if score > max_score:
-                        best_fill = fill
-                        max_score = score
+def _process_one_png(args):
+    """
+    Analyze one segment PNG (mask + matching SVG color) and return its
+    segment dict without an id, or None if the mask is unusable. Runs in a
+    worker process, so it takes a single picklable args tuple.
+    """
+    (png_path, fallback_dir, svg_segments_root, svg_segments_root_plus,
+     fallback_names, primary_names, plus_names) = args
 
-            for child in list(node):
-                walk(child, current_visible)
+    image = cv2.imread(str(png_path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    binary = _binary_mask(image)
+
+    # One countNonZero serves both the fallback ratio and the pixel area
+    nonzero = cv2.countNonZero(binary)
+    white_ratio = nonzero / (binary.shape[0] * binary.shape[1])
+
+    # Fallback only applies to near-empty masks with unnamed segments; the
+    # directory listings were snapshotted once, so this is a set lookup
+    use_fallback = (
+        white_ratio < 0.05
+        and not any(k in png_path.name for k in ("Layer", "Item"))
+        and png_path.name in fallback_names
+    )
+    if use_fallback:
+        fallback_png = fallback_dir / png_path.name
+        png_path = fallback_png
+        # White masks carry no alpha worth keeping, so let libpng decode
+        # straight to gray instead of loading all channels + cvtColor
+        image = cv2.imread(str(png_path), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            log.error("Could not load fallback image: %s", fallback_png)
+            return None
+        binary = _binary_mask(image)
+        nonzero = cv2.countNonZero(binary)
 
-        walk(root)
+    # Labels, per-blob bboxes and areas fall out of one connected-components
+    # pass; no contour extraction needed since only bbox + area are consumed
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if count < 2:
+        return None
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    if stats[largest, cv2.CC_STAT_AREA] < 3:
+        log.warning("Skipping %s — foreground too small to use.", png_path.name)
+        return None
 
-        if best_fill and best_fill.startswith("url(#"):
-            gradient_id = best_fill[5:-1]
-            return resolve_gradient_color(gradient_id)
+    pixel_area = nonzero
+    x, y, w, h = (int(v) for v in stats[largest, :4])
 
-        return parse_svg_color_to_rgba(best_fill) if best_fill else None
+    base_name = png_path.name.replace("_highlighted.png", "") if "_highlighted.png" in png_path.name else png_path.stem
+    segment_svg_filename = f"{base_name}.svg"
 
-    except Exception as e:
-        print(f"⚠️ Failed to parse {svg_path.name}: {e}")
-        return None
+    if segment_svg_filename in primary_names:
+        svg_path = svg_segments_root / segment_svg_filename
+    elif segment_svg_filename in plus_names:
+        svg_path = svg_segments_root_plus / segment_svg_filename
+    else:
+        svg_path = None
+    color = extract_svg_fill_color(svg_path) if svg_path else None
+
+    return {
+        "filename": png_path.name,
+        "pixel_area": pixel_area,
+        "bbox": (x, y, w, h),
+        "color": color,
+    }
 
 def load_png_segments(png_folder: Path, svg_segments_root: Path, svg_segments_root_plus: Path, selected_folder: str):
     segments = []
@@ -167,7 +318,6 @@ def load_png_segments(png_folder: Path, svg_segments_root: Path, svg_segments_ro
     segments.append({
         "id": 0,
         "filename": f"Full {full_name}",
-        "polygon": None,
         "pixel_area": None,
         "bbox": None,
         "color": full_color,
@@ -175,77 +325,68 @@ def load_png_segments(png_folder: Path, svg_segments_root: Path, svg_segments_ro
     })
 
     fallback_dir = Path("outputs") / full_name / FALLBACK_WHITE_DIR
-    # Process individual PNG segments
-    for idx, png_path in enumerate(sorted(png_folder.glob("*.png"), key=lambda p: extract_index_from_filename(p.name)), start=1):
-        if "full" in png_path.name.lower():
-            continue
-        image = cv2.imread(str(png_path), cv2.IMREAD_UNCHANGED)
-        if image is None:
-            continue
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
-
-        white_ratio = np.count_nonzero(binary) / (binary.shape[0] * binary.shape[1])
-        # if white_ratio < 0.05 and not any(k in png_path.name for k in ["Layer", "Item"]):
-        is_named_element = any(k in png_path.name for k in ["Layer", "Item"])
-        
-        # Check for small visible area, fallback only if name isn't meaningful
-        fallback_png = fallback_dir / png_path.name
-        use_fallback = white_ratio < 0.05 and not is_named_element and fallback_png.exists()
-        if use_fallback:
-            png_path = fallback_png
-            image = cv2.imread(str(png_path), cv2.IMREAD_UNCHANGED)
-            if image is None:
-                print(f"❌ Could not load fallback image: {fallback_png}")
-                continue
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
-
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            continue
-
-        largest = max(contours, key=cv2.contourArea)
-        coords = [(int(pt[0][0]), int(pt[0][1])) for pt in largest]
-
-        # Ensure there are at least 3 distinct points
-        if len(coords) < 3:
-            print(f"⚠️ Skipping {png_path.name} — not enough points to form a polygon.")
-            continue
+    # Snapshot each lookup directory once; workers then resolve fallback
+    # masks and matching SVGs with set membership instead of three exists()
+    # stats per segment
+    fallback_names = _dir_names(fallback_dir)
+    primary_names = _dir_names(svg_segments_root)
+    plus_names = _dir_names(svg_segments_root_plus)
+    # Process individual PNG segments; each one is independent CPU work
+    # (decode + threshold + contours + SVG parse), so larger groups fan out
+    # over a process pool
+    # Decorate-sort-undecorate: one index extraction per file instead of
+    # one per comparison inside sorted()
+    keyed = [
+        (extract_index_from_filename(p.name), p)
+        for p in png_folder.glob("*.png")
+        if "full" not in p.name.lower()
+    ]
+    keyed.sort()
+    png_paths = [p for _, p in keyed]
+    tasks = [
+        (p, fallback_dir, svg_segments_root, svg_segments_root_plus,
+         fallback_names, primary_names, plus_names)
+        for p in png_paths
+    ]
 
-        # Ensure it's closed
-        if coords[0] != coords[-1]:
-            coords.append(coords[0])
+    if _IN_GROUP_WORKER or len(tasks) < 4:
+        results = [_process_one_png(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(_process_one_png, tasks))
 
-        try:
-            polygon = Polygon(coords).buffer(0)
-        except Exception as e:
-            print(f"❌ Failed to create polygon for {png_path.name}: {e}")
+    idx = 1
+    for seg in results:
+        if seg is None:
             continue
-
-        pixel_area = np.count_nonzero(binary)
-        x, y, w, h = cv2.boundingRect(binary)
-
-        base_name = png_path.name.replace("_highlighted.png", "") if "_highlighted.png" in png_path.name else png_path.stem
-        segment_svg_filename = f"{base_name}.svg"
-
-        primary_svg_path = svg_segments_root / segment_svg_filename
-        plus_svg_path = svg_segments_root_plus / segment_svg_filename
-
-        svg_path = primary_svg_path if primary_svg_path.exists() else (plus_svg_path if plus_svg_path.exists() else None)
-        color = extract_svg_fill_color(svg_path) if svg_path and svg_path.exists() else None
-
-        segments.append({
-            "id": idx,
-            "filename": png_path.name,
-            "polygon": polygon,
-            "pixel_area": pixel_area,
-            "bbox": (x, y, w, h),
-            "color": color,
-        })
+        seg["id"] = idx
+        idx += 1
+        segments.append(seg)
 
     return segments
 
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _assign_parents(bboxes, areas, margin):
+        """Smallest strictly-larger containing bbox per row, or -1."""
+        n = bboxes.shape[0]
+        out = np.full(n, -1, dtype=np.int64)
+        for i in prange(n):
+            cx, cy, cw, ch = bboxes[i, 0], bboxes[i, 1], bboxes[i, 2], bboxes[i, 3]
+            child_area = areas[i]
+            best = -1
+            best_area = np.int64(1) << 62
+            for j in range(n):
+                if j == i or areas[j] <= child_area or areas[j] >= best_area:
+                    continue
+                px, py, pw, ph = bboxes[j, 0], bboxes[j, 1], bboxes[j, 2], bboxes[j, 3]
+                if (cx >= px - margin and cy >= py - margin and
+                        cx + cw <= px + pw + margin and cy + ch <= py + ph + margin):
+                    best_area = areas[j]
+                    best = j
+            out[i] = best
+        return out
+
 def build_hierarchy_bbox(segments, margin=5):
     """
     For each segment, assign the smallest parent segment whose bounding box contains it.
@@ -253,64 +394,77 @@ def build_hierarchy_bbox(segments, margin=5):
     for seg in segments:
         seg["parent"] = 0  # default to root if no parent found
 
-    for child in segments:
-        if child.get("bbox") is None:
-            continue # Skip full SVG or invalid segment
+    candidates = [seg for seg in segments if seg.get("bbox") is not None]
+    if not candidates:
+        return segments
+
+    # Envelope index over margin-expanded candidate boxes: each child only
+    # examines the handful of overlapping candidates instead of all N.
+    # Bboxes live in one SoA matrix so the containment test is four
+    # vectorized comparisons rather than scalar dict arithmetic.
+    X = np.array([c["bbox"] for c in candidates], dtype=np.int64)  # px, py, pw, ph
+    areas = X[:, 2] * X[:, 3]
+    ids = np.array([c["id"] for c in candidates], dtype=np.int64)
+
+    # With numba present the whole assignment runs as one compiled parallel
+    # kernel; the brute-force inner scan is cheap once it's machine code
+    if njit is not None:
+        parents = _assign_parents(X, areas, np.int64(margin))
+        for i, child in enumerate(candidates):
+            if parents[i] >= 0:
+                child["parent"] = int(ids[parents[i]])
+        return segments
+
+    boxes = [
+        box(px - margin, py - margin, px + pw + margin, py + ph + margin)
+        for px, py, pw, ph in X
+    ]
+    tree = STRtree(boxes)
 
-        best_parent = None
-        best_area = float("inf")
+    for i, child in enumerate(candidates):
         cx, cy, cw, ch = child["bbox"]
         child_area = cw * ch
+        hits = tree.query(box(cx, cy, cx + cw, cy + ch))
+        if hits.size == 0:
+            continue
 
-        for candidate in segments:
-            if candidate["id"] == child["id"]:
-                continue
-            if candidate.get("bbox") is None:
-                continue  # Skip invalid candidate
-
-            px, py, pw, ph = candidate["bbox"]
-            parent_area = pw * ph
-
-            # Must be strictly larger and contain the child
-            if parent_area <= child_area:
+        # Sweep the hits smallest-area-first: the first strictly larger
+        # candidate that contains the child is the best parent by
+        # construction, so the scan stops there
+        for j in hits[np.argsort(areas[hits], kind="stable")]:
+            if j == i or areas[j] <= child_area:
                 continue
-
+            px, py, pw, ph = X[j]
             if (cx >= px - margin and cy >= py - margin and
-                cx + cw <= px + pw + margin and
-                cy + ch <= py + ph + margin):
-                if parent_area < best_area:
-                    best_area = parent_area
-                    best_parent = candidate["id"]
-
-        if best_parent is not None:
-            child["parent"] = best_parent
+                    cx + cw <= px + pw + margin and cy + ch <= py + ph + margin):
+                child["parent"] = int(ids[j])
+                break
 
     return segments
 
+@lru_cache(maxsize=512)
+def _load_json_cached(path_str: str, mtime_ns: int):
+    return orjson.loads(Path(path_str).read_bytes())
+
+def _load_json(path: Path):
+    """Parse a JSON file, cached per (path, mtime) for the process lifetime."""
+    try:
+        return _load_json_cached(str(path), path.stat().st_mtime_ns)
+    except OSError:
+        return None
+    except orjson.JSONDecodeError:
+        log.error("Invalid JSON in %s", path)
+        return None
+
 def export_hierarchy_json(segments, output_path: Path, group_name: str):
     response_path = Path("outputs") / group_name / RESPONSES_DIR  / "response.json"
     metadata_path = Path("outputs") / group_name / RESPONSES_DIR  / "scene_metadata.json"
 
-    # Load Gemini response data
-    gemini_data = []
-    if response_path.exists():
-        with open(response_path) as f:
-            try:
-                gemini_data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"❌ Invalid JSON in {response_path}")
-
-    # Load global style & description
-    global_style = ""
-    description = ""
-    if metadata_path.exists():
-        try:
-            with open(metadata_path) as f:
-                metadata = json.load(f)
-                global_style = metadata.get("global_style", "")
-                description = metadata.get("description", "")
-        except:
-            pass
+    # Load Gemini response data and scene metadata (cached across groups)
+    gemini_data = _load_json(response_path) or []
+    metadata = _load_json(metadata_path) or {}
+    global_style = metadata.get("global_style", "")
+    description = metadata.get("description", "")
 
     # Build index from Gemini response using full filename
     gemini_index = {}
@@ -347,6 +501,12 @@ def export_hierarchy_json(segments, output_path: Path, group_name: str):
     for item in all_items:
         parent_to_children.setdefault(item["parent"], []).append(item)
 
+    # Sort each sibling list once up front; the BFS below then just extends
+    # the queue instead of re-sorting the same children on every pop
+    by_filename = itemgetter("filename")
+    for children in parent_to_children.values():
+        children.sort(key=by_filename)
+
     # ✅ Find the true root (parent == -1)
     root_items = parent_to_children.get(-1, [])
     if not root_items:
@@ -384,7 +544,7 @@ def export_hierarchy_json(segments, output_path: Path, group_name: str):
 
             new_scene.append(entry)
 
-            for child in sorted(parent_to_children.get(old_id, []), key=lambda x: x["filename"]):
+            for child in parent_to_children.get(old_id, ()):
                 queue.append(child["id"])
 
 
@@ -394,12 +554,44 @@ def export_hierarchy_json(segments, output_path: Path, group_name: str):
     }
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(final_output, f, indent=2)
+    output_path.write_bytes(orjson.dumps(final_output, option=orjson.OPT_INDENT_2))
+
+def _process_group(args):
+    """
+    Process one input SVG end to end (segments, hierarchy, export) and
+    return the output path, or None if skipped. Runs in a worker process.
+    """
+    global _IN_GROUP_WORKER
+    _IN_GROUP_WORKER = True
+
+    svg_file, selected_folder = args
+    svg_id = svg_file.stem
+
+    base_output = Path("outputs") / svg_id
+    png_dir = base_output / HIGHLIGHTED_DIR
+    regular_svg_dir = base_output / "segmented_svgs"
+    plus_svg_dir = SEGMENTS_DIR_PLUS / svg_id
+
+    if not png_dir.exists():
+        log.warning("Skipping %s: highlighted_pngs_no_overlay not found.", svg_id)
+        return None
+
+    segments = load_png_segments(png_dir, regular_svg_dir, plus_svg_dir, selected_folder)
+    if not segments:
+        log.warning("No valid segments found for %s", svg_id)
+        return None
+
+    segments_with_parents = build_hierarchy_bbox(segments)
+    output_path = base_output / "hierarchy_output" / f"{svg_id}_hierarchy.json"
+    export_hierarchy_json(segments_with_parents, output_path, svg_id)
+    return output_path
 
 def main():
+    # Per-segment chatter goes through logging; default WARNING keeps the
+    # hot loops free of stdout syscalls, SVG_LOG=INFO turns it back on
+    logging.basicConfig(level=os.environ.get("SVG_LOG", "WARNING"), format="%(message)s")
+
     inputs_dir = Path("inputs")
-    outputs_dir = Path("outputs")
 
     # Step 1: Select a folder from inputs/
     folders = [f.name for f in inputs_dir.iterdir() if f.is_dir()]
@@ -422,30 +614,17 @@ def main():
 
     print(f"📁 Selected folder: {selected_folder} — Found {len(svg_files)} SVG files.")
 
-    for svg_file in tqdm(svg_files, desc="Processing SVGs"):
-        svg_id = svg_file.stem
-        print(f"\n🧩 Processing: {svg_id}")
-
-        base_output = outputs_dir / svg_id
-        png_dir = base_output / HIGHLIGHTED_DIR
-        regular_svg_dir = base_output / "segmented_svgs"
-        plus_svg_dir = SEGMENTS_DIR_PLUS / svg_id
-
-        if not png_dir.exists():
-            print(f"⚠️ Skipping {svg_id}: highlighted_pngs_no_overlay not found.")
-            continue
-
-        segments = load_png_segments(png_dir, regular_svg_dir, plus_svg_dir, selected_folder)
-
-        if not segments:
-            print(f"⚠️ No valid segments found for {svg_id}")
-            continue
-        
-        print(f"segments length:  {len(segments)}")
-        segments_with_parents = build_hierarchy_bbox(segments)
-        output_path = base_output / "hierarchy_output" / f"{svg_id}_hierarchy.json"
-        export_hierarchy_json(segments_with_parents, output_path, svg_id)
-        tqdm.write(f"✅ Saved: {output_path}")
+    # Groups are independent, so process them across cores; HIERARCHY_WORKERS
+    # overrides the pool size when set
+    max_workers = int(os.environ.get("HIERARCHY_WORKERS", 0)) or min(os.cpu_count(), len(svg_files))
+    tasks = [(svg_file, selected_folder) for svg_file in svg_files]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for output_path in tqdm(
+            executor.map(_process_group, tasks),
+            total=len(tasks), desc="Processing SVGs"
+        ):
+            if output_path is not None:
+                tqdm.write(f"✅ Saved: {output_path}")
 
 if __name__ == "__main__":
     main()
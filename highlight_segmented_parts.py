@@ -1,52 +1,114 @@
 #!/usr/bin/env python3
 
 import os
-import xml.etree.ElementTree as ET
+import re
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import lru_cache, partial
+from lxml import etree as ET
 from pathlib import Path
 import inquirer
 from tqdm import tqdm
-from convert_svg_highlights_to_png import convert_svg_folder
+from PIL import Image
+from convert_svg_highlights_to_png import convert_svg_folder, render_svg_rgba
 from collections import defaultdict
 
 OUTPUT_ROOT = Path("outputs")
 
+# One parser instance shared across every parse; huge_tree lifts libxml2's
+# default node limits for pathological exports
+_XML_PARSER = ET.XMLParser(remove_blank_text=True, huge_tree=True,
+                           collect_ids=False, remove_comments=True)
+
+# Matches any stroke-* declaration including its leading separator, so one
+# compiled substitution replaces the split/filter/join rebuild of the style
+SVG_NS = 'http://www.w3.org/2000/svg'
+RECT_TAG = f'{{{SVG_NS}}}rect'
+G_TAG = f'{{{SVG_NS}}}g'
+DEFS_TAG = f'{{{SVG_NS}}}defs'
+MASK_TAG = f'{{{SVG_NS}}}mask'
+
+# Constant elements stamped out with deepcopy per segment instead of being
+# rebuilt from tag/dict literals in the hot path
+# Both qualified and bare names, so unnamespaced segment exports still
+# match; membership is a hash probe instead of endswith's substring scan
+_DEFS_TAGS = frozenset({DEFS_TAG, 'defs'})
+_G_TAGS = frozenset({G_TAG, 'g'})
+
+_BLACK_RECT_TEMPLATE = ET.Element(RECT_TAG, {
+    'x': '0', 'y': '0', 'width': '100%', 'height': '100%', 'fill': 'black'
+})
+_OVERLAY_RECT_TEMPLATE = ET.Element(RECT_TAG, {
+    'x': '0', 'y': '0', 'width': '100%', 'height': '100%',
+    'fill': 'black', 'mask': 'url(#spotlight-mask)'
+})
+
+_STROKE_PROP_RE = re.compile(r'(?:^|;)\s*stroke[^;]*')
+
+def _strip_stroke_props(style):
+    if 'stroke' not in style:
+        return style
+    return _STROKE_PROP_RE.sub('', style).lstrip(';')
+
+def _scan_dirs(path):
+    """Subdirectory names via one scandir pass; DirEntry.is_dir reads the
+    cached d_type instead of issuing a stat per entry."""
+    try:
+        with os.scandir(path) as it:
+            return [e.name for e in it if e.is_dir()]
+    except OSError:
+        return []
+
+def _scan_svgs(path):
+    try:
+        with os.scandir(path) as it:
+            return [Path(e.path) for e in it if e.name.endswith('.svg') and e.is_file()]
+    except OSError:
+        return []
+
+def _has_entries(path):
+    try:
+        with os.scandir(path) as it:
+            return next(iter(it), None) is not None
+    except OSError:
+        return False
+
+@lru_cache(maxsize=None)
+def _originals_index(base_path: str) -> dict:
+    """stem -> resolved path for every original, listed once per base dir.
+    First match wins, mirroring the old per-call folder walk order."""
+    index = {}
+    base = Path(base_path)
+    for folder in _scan_dirs(base):
+        for candidate in _scan_svgs(base / folder):
+            index.setdefault(candidate.stem, candidate.resolve())
+    return index
+
 def find_original_svg(originals_dir, svg_id):
     """
     Search the parent directory of originals_dir for the original SVG file.
     """
     originals_base_path = Path(originals_dir).parent / "inputs"
-    for folder in originals_base_path.iterdir():
-        if not folder.is_dir():
-            continue
-        candidate = folder / f"{svg_id}.svg"
-        if candidate.exists():
-            return candidate.resolve()
+    found = _originals_index(str(originals_base_path)).get(svg_id)
+    if found is not None:
+        return found
     # Check also directly inside originals_dir
     direct_candidate = Path(originals_dir) / f"{svg_id}.svg"
     if direct_candidate.exists():
         return direct_candidate.resolve()
     return None
 
-def add_black_overlay(svg_root, highlighted_group, opacity=0.9):
+def build_spotlight_parts(highlighted_group, opacity=0.9):
     """
-    Add a dark overlay to dim the whole SVG, and reveal only the highlighted segment.
-    Simulates a spotlight effect using an SVG mask.
+    Build the spotlight mask and overlay rect for a highlighted segment.
+    Returns (defs, overlay): a <defs> holding the mask, and the full-size
+    black rect that applies it. The mask dims the whole SVG and reveals
+    only the highlighted shapes.
     """
-    svg_ns = 'http://www.w3.org/2000/svg'
-
-    # Create <defs> if not present
-    defs = svg_root.find(f'{{{svg_ns}}}defs')
-    if defs is None:
-        defs = ET.Element(f'{{{svg_ns}}}defs')
-        svg_root.insert(0, defs)
-
-    # Create a unique ID for the mask
-    mask_id = 'spotlight-mask'
-
     # Build mask: black overlay with transparent cutout
-    mask = ET.Element(f'{{{svg_ns}}}mask', {'id': mask_id})
+    mask = ET.Element(MASK_TAG, {'id': 'spotlight-mask'})
     # Fully opaque black background
-    mask.append(ET.Element(f'{{{svg_ns}}}rect', {
+    mask.append(ET.Element(RECT_TAG, {
         'x': '0', 'y': '0',
         'width': '100%', 'height': '100%',
         'fill': 'white', 'opacity': str(opacity)
@@ -54,23 +116,17 @@ def add_black_overlay(svg_root, highlighted_group, opacity=0.9):
 
     # Add the shape to the mask as a transparent area (black = reveal)
     for elem in highlighted_group:
-        visible_shape = ET.Element(elem.tag, elem.attrib)
+        visible_shape = ET.Element(elem.tag, dict(elem.attrib))
         visible_shape.attrib['fill'] = 'black'
         visible_shape.attrib.pop('stroke', None)
         mask.append(visible_shape)
 
+    defs = ET.Element(DEFS_TAG)
     defs.append(mask)
 
-    # Create full black rect and apply the mask
-    overlay = ET.Element(f'{{{svg_ns}}}rect', {
-        'x': '0', 'y': '0',
-        'width': '100%', 'height': '100%',
-        'fill': 'black',
-        'mask': f'url(#{mask_id})'
-    })
-
-    svg_root.append(overlay)
-    svg_root.append(highlighted_group)
+    # Full black rect that applies the mask
+    overlay = deepcopy(_OVERLAY_RECT_TEMPLATE)
+    return defs, overlay
 
 
 def convert_full_svg_to_png(originals_dir, selected_folder, svg_id):
@@ -78,8 +134,6 @@ def convert_full_svg_to_png(originals_dir, selected_folder, svg_id):
     Converts full SVG to PNG and saves it as:
     outputs/<svg_id>/highlighted_pngs/<svg_id>-full.png
     """
-    import cairosvg
-
     svg_path = Path(originals_dir) / selected_folder / f"{svg_id}.svg"
     output_path = Path("outputs") / svg_id / "highlighted_pngs" / f"{svg_id}-full.png"
 
@@ -90,12 +144,10 @@ def convert_full_svg_to_png(originals_dir, selected_folder, svg_id):
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
     try:
-        cairosvg.svg2png(
-            url=str(svg_path),
-            write_to=str(output_path),
-            output_width=512,
-            output_height=512
-        )
+        # Same persistent renderer as the batch converter: pooled cairo
+        # surface, no per-call cairosvg setup or PNG round-trip
+        arr = render_svg_rgba(svg_path.read_bytes(), 512, 512, url=str(svg_path))
+        Image.fromarray(arr).save(output_path)
         print(f"✅ Saved full PNG: {output_path}")
     except Exception as e:
         print(f"❌ Failed to convert full SVG to PNG for {svg_id}: {e}")
@@ -114,17 +166,34 @@ def highlight_segments(originals_dir, selected_folder, svg_id):
     if original_root is None:
         return
 
+    # Build the defs-first base document once; each segment revives it with
+    # a cheap in-memory fromstring instead of re-copying the original tree
+    overlay_template = _build_overlay_template(original_root)
+    base = _build_base_snapshot(original_root)
+
+    worker = partial(
+        process_segment_file,
+        base=base,
+        overlay_template=overlay_template,
+        svg_id=svg_id,
+        selected_folder=selected_folder,
+        highlighted_dir=highlighted_dir,
+        white_dir=white_dir,
+        no_overlay_dir=no_overlay_dir,
+    )
+
     print(f"📦 Processing {svg_id} ({len(segment_files)} segments)")
-    for segment_file in tqdm(segment_files, desc=f"🔧 {svg_id}", unit="segment"):
-        process_segment_file(
-            segment_file,
-            original_root,
-            svg_id,
-            selected_folder,
-            highlighted_dir,
-            white_dir,
-            no_overlay_dir
-        )
+    # Segments are independent (own parse, three output files), so bigger
+    # jobs fan out one file per process; tiny jobs skip the pool overhead
+    if len(segment_files) < 4:
+        for segment_file in tqdm(segment_files, desc=f"🔧 {svg_id}", unit="segment"):
+            worker(segment_file)
+    else:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(tqdm(
+                executor.map(worker, segment_files),
+                total=len(segment_files), desc=f"🔧 {svg_id}", unit="segment"
+            ))
 
 def prepare_output_dirs(base_output):
     highlighted_dir = base_output / "highlighted_svgs"
@@ -138,19 +207,19 @@ def collect_segment_files(svg_id, base_output):
     plus_dir = Path("segmented_svgs_plus") / svg_id
     seg_dir = base_output / "segmented_svgs"
 
-    segment_dirs = []
-    if seg_dir.exists() and seg_dir.is_dir():
-        segment_dirs.append(seg_dir)
+    # List each candidate directory once; existence, the SVG check and the
+    # file collection all come out of the same scandir pass
+    seg_svgs = _scan_svgs(seg_dir)
+    if seg_dir.is_dir():
         print(f"✅ Found in outputs/{svg_id}/segmented_svgs")
-    if plus_dir.exists() and any(plus_dir.glob("*.svg")):
-        segment_dirs.append(plus_dir)
+    plus_svgs = _scan_svgs(plus_dir)
+    if plus_svgs:
         print(f"✅ Also found in segmented_svg_plus/{svg_id}")
     elif plus_dir.exists():
         print(f"⚠️ No SVGs in segmented_svg_plus/{svg_id}")
 
     segment_files = []
-    for source in segment_dirs:
-        found = list(source.glob("*.svg"))
+    for source, found in ((seg_dir, seg_svgs), (plus_dir, plus_svgs)):
         if found:
             print(f"   🔹 Found {len(found)} segments in {source}")
             segment_files.extend(found)
@@ -162,11 +231,52 @@ def load_original_svg(originals_dir, selected_folder, svg_id):
         print(f"⚠️ Original SVG not found: {original_path}")
         return None
     try:
-        return ET.parse(original_path).getroot()
-    except ET.ParseError as e:
+        # One contiguous read + in-memory parse; libxml2 is faster over a
+        # single buffer than over incremental file I/O for small documents
+        return ET.fromstring(original_path.read_bytes(), _XML_PARSER)
+    except ET.XMLSyntaxError as e:
         print(f"⚠️ Failed to parse original SVG {svg_id}: {e}")
         return None
 
+def _build_overlay_template(original_root):
+    """
+    Serialize the defs-first base document once and split it around the
+    closing root tag. Only the mask/overlay/highlight fragment varies per
+    segment, so each output is prefix + fragment + suffix byte
+    concatenation — no tree rebuild or base re-serialization per file.
+    """
+    template = ET.Element(original_root.tag, dict(original_root.attrib))
+    for defs in original_root.findall(f'.//{DEFS_TAG}'):
+        template.append(deepcopy(defs))
+    for child in list(original_root):
+        if isinstance(child.tag, str) and child.tag not in _DEFS_TAGS:
+            template.append(deepcopy(child))
+
+    doc = ET.tostring(template)
+    declaration = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    try:
+        split = doc.rindex(b'</')
+        return declaration + doc[:split], doc[split:]
+    except ValueError:
+        # A childless original serializes self-closed; reopen it so the
+        # per-segment fragment can be spliced in
+        name = doc[1:].split(None, 1)[0].rstrip(b'/>')
+        return declaration + doc[:doc.rindex(b'/>')] + b'>', b'</' + name + b'>'
+
+def _build_base_snapshot(original_root):
+    """
+    The pieces of the original every per-segment builder needs: root tag,
+    a plain attrib dict and the serialized defs, all resolved once per
+    svg_id instead of re-walking the tree for every segment file.
+    """
+    # defs travel as serialized bytes so the snapshot pickles cleanly into
+    # worker processes (lxml elements do not)
+    return (
+        original_root.tag,
+        dict(original_root.attrib),
+        tuple(ET.tostring(d) for d in original_root.findall(f'.//{DEFS_TAG}')),
+    )
+
 def extract_visible_elements(segment_root):
     """
     Extract visible elements from a segment root, handling both regular and plus folder structures.
@@ -177,9 +287,9 @@ def extract_visible_elements(segment_root):
     # Check if this is a plus folder structure (multiple groups with display:none)
     has_plus_structure = False
     for child in segment_root:
-        if child.tag.endswith('defs'):
+        if not isinstance(child.tag, str) or child.tag in _DEFS_TAGS:
             continue
-        if child.tag.endswith('g') and 'style' in child.attrib:
+        if child.tag in _G_TAGS and 'style' in child.attrib:
             style = child.attrib['style']
             if 'display:none' in style:
                 has_plus_structure = True
@@ -188,74 +298,79 @@ def extract_visible_elements(segment_root):
     if has_plus_structure:
         # Plus folder structure: find the group that should be visible
         for child in segment_root:
-            if child.tag.endswith('defs'):
+            if not isinstance(child.tag, str) or child.tag in _DEFS_TAGS:
                 continue
-            if child.tag.endswith('g'):
+            if child.tag in _G_TAGS:
                 style = child.attrib.get('style', '')
                 # Look for groups that are NOT display:none
                 if 'display:none' not in style:
                     # This is the visible group, extract its children
                     for grandchild in child:
-                        if grandchild.tag.endswith('defs'):
+                        if not isinstance(grandchild.tag, str) or grandchild.tag in _DEFS_TAGS:
                             continue
                         visible_elements.append(grandchild)
                     break
     else:
         # Regular structure: all direct children are visible
         for child in list(segment_root):
-            if child.tag.endswith('defs'):
+            if not isinstance(child.tag, str) or child.tag in _DEFS_TAGS:
                 continue
             visible_elements.append(child)
     
     return visible_elements
 
-def process_segment_file(segment_file, original_root, svg_id, selected_folder, highlighted_dir, white_dir, no_overlay_dir):
+def process_segment_file(segment_file, base, overlay_template, svg_id, selected_folder, highlighted_dir, white_dir, no_overlay_dir):
     try:
-        segment_tree = ET.parse(segment_file)
-        segment_root = segment_tree.getroot()
-    except ET.ParseError as e:
+        segment_root = ET.fromstring(segment_file.read_bytes(), _XML_PARSER)
+    except ET.XMLSyntaxError as e:
         print(f"⚠️ Error parsing {segment_file.name}: {e}")
         return
 
+    # One segment-tree walk feeds all three outputs
+    visible_elements = extract_visible_elements(segment_root)
+
     # Create overlay version
-    combined_svg = create_combined_svg_with_overlay(original_root, segment_root)
     highlighted_path = highlighted_dir / f"{segment_file.stem}_highlighted.svg"
-    ET.ElementTree(combined_svg).write(highlighted_path)
+    write_overlay_svg(overlay_template, visible_elements, highlighted_path)
 
     # Create no-overlay version
-    create_combined_svg_with_black_background(segment_root, original_root, svg_id, selected_folder, segment_file.stem)
+    create_combined_svg_with_black_background(visible_elements, base, svg_id, selected_folder, segment_file.stem)
 
     # Create white mask version
-    white_svg = create_white_mask_svg(original_root, segment_root)
+    white_svg = create_white_mask_svg(base, visible_elements)
     white_path = white_dir / f"{segment_file.stem}_highlighted.svg"
-    ET.ElementTree(white_svg).write(white_path)
+    white_path.write_bytes(ET.tostring(white_svg, xml_declaration=True, encoding='utf-8'))
 
-def create_combined_svg_with_overlay(original_root, segment_root):
-    svg_ns = 'http://www.w3.org/2000/svg'
-    combined_svg = ET.Element(original_root.tag, original_root.attrib)
-    for defs in original_root.findall(f'.//{{{svg_ns}}}defs'):
-        combined_svg.append(defs)
-    for child in list(original_root):
-        if not child.tag.endswith('defs'):
-            combined_svg.append(child)
+def write_overlay_svg(overlay_template, visible_elements, output_path):
+    """
+    Write the spotlight version as prefix + per-segment fragment + suffix:
+    the base document bytes come straight from the precomputed template,
+    so only the mask defs, overlay rect and highlight group are serialized
+    per segment.
+    """
+    prefix, suffix = overlay_template
 
-    highlighted_group = ET.Element(f'{{{svg_ns}}}g', {'id': 'highlighted-segment'})
-    visible_elements = extract_visible_elements(segment_root)
-    
+    highlighted_group = ET.Element(G_TAG, {'id': 'highlighted-segment'})
     for elem in visible_elements:
-        outer = ET.Element(elem.tag, elem.attrib.copy())
-        style = elem.attrib.get('style', '')
-        clean_style = ';'.join(kv for kv in style.split(';') if not kv.strip().startswith('stroke')).strip(';')
-        elem.attrib['style'] = clean_style
+        outer = ET.Element(elem.tag, dict(elem.attrib))
+        inner = deepcopy(elem)
+        inner.attrib['style'] = _strip_stroke_props(inner.attrib.get('style', ''))
         highlighted_group.append(outer)
-        highlighted_group.append(elem)
+        highlighted_group.append(inner)
 
-    add_black_overlay(combined_svg, highlighted_group)
-    return combined_svg
+    mask_defs, overlay = build_spotlight_parts(highlighted_group)
+
+    output_path.write_bytes(b''.join((
+        prefix,
+        ET.tostring(mask_defs),
+        ET.tostring(overlay),
+        ET.tostring(highlighted_group),
+        suffix,
+    )))
 
 def create_combined_svg_with_black_background(
-    segment_root: ET.Element,
-    original_root: ET.Element,
+    visible_elements,
+    base,
     svg_id: str,
     selected_folder: str,
     segment_file_stem: str
@@ -264,63 +379,46 @@ def create_combined_svg_with_black_background(
     Save a highlighted segment with solid black background (no transparency or overlay).
     Saved under: outputs/<svg_id>/highlighted_svgs_no_overlay/
     """
+    # Created once per svg_id by prepare_output_dirs before the segment loop
     output_dir = OUTPUT_ROOT / svg_id / "highlighted_svgs_no_overlay"
-    output_dir.mkdir(parents=True, exist_ok=True)
 
-    svg_ns = 'http://www.w3.org/2000/svg'
-    new_svg = ET.Element(original_root.tag, original_root.attrib)
+    root_tag, root_attrib, defs_list = base
+    new_svg = ET.Element(root_tag, dict(root_attrib))
 
-    for defs in original_root.findall(f'.//{{{svg_ns}}}defs'):
-        new_svg.append(defs)
+    for defs_bytes in defs_list:
+        new_svg.append(ET.fromstring(defs_bytes, _XML_PARSER))
 
-    black_rect = ET.Element(f'{{{svg_ns}}}rect', {
-        'x': '0',
-        'y': '0',
-        'width': '100%',
-        'height': '100%',
-        'fill': 'black'
-    })
-    new_svg.append(black_rect)
+    new_svg.append(deepcopy(_BLACK_RECT_TEMPLATE))
 
-    highlight_group = ET.Element(f'{{{svg_ns}}}g', {'id': 'highlighted-segment'})
-    visible_elements = extract_visible_elements(segment_root)
-    
+    highlight_group = ET.Element(G_TAG, {'id': 'highlighted-segment'})
     for elem in visible_elements:
-        outer = ET.Element(elem.tag, elem.attrib.copy())
-
-        original_style = elem.attrib.get('style', '')
-        style_parts = [kv for kv in original_style.split(';') if not kv.strip().startswith('stroke')]
-        elem.attrib['style'] = ';'.join(style_parts)
-
+        outer = ET.Element(elem.tag, dict(elem.attrib))
+        inner = deepcopy(elem)
+        inner.attrib['style'] = _strip_stroke_props(inner.attrib.get('style', ''))
         highlight_group.append(outer)
-        highlight_group.append(elem)
+        highlight_group.append(inner)
 
     new_svg.append(highlight_group)
 
     output_path = output_dir / f"{segment_file_stem}_highlighted.svg"
     try:
-        ET.ElementTree(new_svg).write(output_path)
+        output_path.write_bytes(ET.tostring(new_svg, xml_declaration=True, encoding='utf-8'))
     except Exception as e:
         tqdm.write(f"⚠️ Failed to write black overlay version: {output_path}: {e}")
 
-def create_white_mask_svg(original_root, segment_root):
-    svg_ns = 'http://www.w3.org/2000/svg'
-    white_svg = ET.Element(original_root.tag, original_root.attrib)
-    bg_rect = ET.Element(f'{{{svg_ns}}}rect', {
-        'x': '0', 'y': '0', 'width': '100%', 'height': '100%', 'fill': 'black'
-    })
-    white_svg.append(bg_rect)
+def create_white_mask_svg(base, visible_elements):
+    root_tag, root_attrib, _ = base
+    white_svg = ET.Element(root_tag, dict(root_attrib))
+    white_svg.append(deepcopy(_BLACK_RECT_TEMPLATE))
 
-    white_group = ET.Element(f'{{{svg_ns}}}g', {
+    white_group = ET.Element(G_TAG, {
         'id': 'white-shapes',
         'style': 'display:inline;opacity:1'
     })
-    
-    visible_elements = extract_visible_elements(segment_root)
-    
+
     # Create white shapes from visible elements
     for elem in visible_elements:
-        white_shape = ET.Element(elem.tag, elem.attrib.copy())
+        white_shape = ET.Element(elem.tag, dict(elem.attrib))
         white_shape.attrib.pop('stroke', None)
         white_shape.attrib['fill'] = 'white'
         white_shape.attrib['style'] = 'fill:white;display:inline;opacity:1'
@@ -333,7 +431,7 @@ def main():
     originals_root = Path("inputs")
 
     # Step 1: Select a folder from inputs/
-    available_folders = [f.name for f in originals_root.iterdir() if f.is_dir()]
+    available_folders = _scan_dirs(originals_root)
     if not available_folders:
         print("❌ No folders found in 'inputs/'")
         return
@@ -369,11 +467,11 @@ def main():
         segment_sources = []
 
         seg_dir = OUTPUT_ROOT / svg_id / "segmented_svgs"
-        if seg_dir.exists() and any(seg_dir.iterdir()):
+        if _has_entries(seg_dir):
             segment_sources.append(seg_dir)
 
         plus_dir = Path("segmented_svgs_plus") / svg_id
-        if plus_dir.exists() and any(plus_dir.iterdir()):
+        if _has_entries(plus_dir):
             segment_sources.append(plus_dir)
             print(f"✅ Found: segmented_svgs_plus/{svg_id}")
 
@@ -135,11 +135,13 @@ def parse_and_format_response(image_paths, gemini_response, output_path=None):
 
     return formatted
 
+_ELEMENT_RE = re.compile(r'_element_(\d+)')
+
 def extract_element_number(filename):
     """
     Extracts the element number from a filename like '..._element_55_highlighted.png'.
     """
-    match = re.search(r'_element_(\d+)', filename)
+    match = _ELEMENT_RE.search(filename)
     if match:
         return int(match.group(1))
     return float('inf')  # If not found, push to the end